@@ -1,149 +1,293 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import re
+from functools import lru_cache
 from io import BytesIO
-from difflib import SequenceMatcher # <-- IMPORTANTE: Aggiunto questo
-
-# --- 1. FUNZIONI DI PULIZIA E UTILITY (Invariate) ---
-
-def pulisci_valuta(valore):
-    """Converte una stringa di valuta in un numero float, gestendo vari formati."""
-    if isinstance(valore, (int, float)):
-        return float(valore)
-    if isinstance(valore, str):
-        # Rimuove lettere, spazi e punti delle migliaia, poi sostituisce la virgola
-        valore_pulito = re.sub(r'[A-Za-z\s\.]', '', valore).replace(',', '.')
-        if valore_pulito:
-            try:
-                return float(valore_pulito)
-            except ValueError:
-                return 0.0
-    return 0.0
+import xlsxwriter
+from rapidfuzz import fuzz, process
+from numba import njit
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
 
+# --- 1. FUNZIONI DI PULIZIA E UTILITY ---
+
+def pulisci_valuta(serie):
+    """Converte una colonna di importi in valuta in numeri float, gestendo vari formati."""
+    # Le colonne numeriche (o del tutto vuote) non hanno testo da ripulire
+    if pd.api.types.is_numeric_dtype(serie) or serie.isna().all():
+        return pd.to_numeric(serie, errors='coerce').fillna(0.0).astype(np.float64)
+    # Rimuove lettere, spazi e punti delle migliaia, poi sostituisce la virgola (su tutta la colonna)
+    testo = serie.str.replace(r'[A-Za-z\s.]', '', regex=True).str.replace(',', '.', regex=False)
+    importi = pd.to_numeric(testo, errors='coerce')
+    # Nelle colonne miste le celle già numeriche non passano dal .str (restano NaN in `testo`)
+    numeri = pd.to_numeric(serie.where(testo.isna()), errors='coerce')
+    return importi.fillna(numeri).fillna(0.0).astype(np.float64)
+
+# Espressioni regolari compilate una volta sola al caricamento del modulo
+# Codici e descrizioni comuni all'inizio
+RE_PREFISSO = re.compile(r'^(BDS-\s*)?BON VITTORIA SIN\s*')
+# Forme societarie e parole comuni, riunite in un'unica alternativa
+PAROLE_DA_RIMUOVERE = [
+    'SNC', 'SAS', 'SRL', 'SPA', 'DI', '&', 'C', 'ESTINTORI', 
+    'TRAPUNTIFICIO', 'ARREDAMENT'
+]
+RE_PAROLE = re.compile(r'\b(?:' + '|'.join(map(re.escape, PAROLE_DA_RIMUOVERE)) + r')\b')
+RE_SPAZI = re.compile(r'\s+')
+
+@lru_cache(maxsize=65536)
 def normalizza_nome_cliente(descrizione):
-    """Estrae e normalizza il nome del cliente dalla descrizione."""
+    """
+    Estrae e normalizza il nome del cliente dalla descrizione.
+    I risultati sono memorizzati: nei registri le stesse descrizioni si ripetono spesso.
+    """
     if not isinstance(descrizione, str): return "N/D"
     nome = descrizione.upper()
-    # Rimuove codici e descrizioni comuni all'inizio
-    nome = re.sub(r'^(BDS-\s*)?BON VITTORIA SIN\s*', '', nome)
-    # Rimuove forme societarie e parole comuni
-    parole_da_rimuovere = [
-        'SNC', 'SAS', 'SRL', 'SPA', 'DI', '&', 'C', 'ESTINTORI', 
-        'TRAPUNTIFICIO', 'ARREDAMENT'
-    ]
-    for parola in parole_da_rimuovere:
-        nome = re.sub(r'\b' + re.escape(parola) + r'\b', '', nome)
-        
-    nome_pulito = re.sub(r'\s+', ' ', nome).strip()
+    nome = RE_PREFISSO.sub('', nome)
+    nome = RE_PAROLE.sub('', nome)
+    nome_pulito = RE_SPAZI.sub(' ', nome).strip()
     return nome_pulito or "N/D"
 
 def to_excel(df):
-    """Converte un DataFrame in un file Excel in memoria per il download."""
+    """
+    Converte un DataFrame in un file Excel in memoria per il download.
+    xlsxwriter in modalità constant_memory tiene in memoria una sola riga alla volta.
+    """
     output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Report')
+    workbook = xlsxwriter.Workbook(output, {
+        'constant_memory': True,
+        'default_date_format': 'dd/mm/yyyy',
+        'remove_timezone': True,
+        'strings_to_formulas': False,
+        'strings_to_urls': False
+    })
+    foglio = workbook.add_worksheet('Report')
+    # In constant_memory le righe vanno scritte in ordine, una dopo l'altra: per questo
+    # non usiamo df.to_excel, che scrive le celle colonna per colonna.
+    intestazione = workbook.add_format({'bold': True, 'border': 1, 'align': 'center'})
+    foglio.write_row(0, 0, [str(colonna) for colonna in df.columns], intestazione)
+    for n_riga, riga in enumerate(df.itertuples(index=False, name=None), start=1):
+        foglio.write_row(n_riga, 0, [None if pd.isna(valore) else valore for valore in riga])
+    workbook.close()
     return output.getvalue()
 
+def to_csv(df):
+    """Converte un DataFrame in CSV per il download (molto più veloce dell'Excel sui report grandi)."""
+    return df.to_csv(index=False).encode('utf-8')
+
+# --- 1.1 CARICAMENTO E PREPARAZIONE DEI DATI (IN CACHE) ---
+
+@st.cache_data(show_spinner=False)
+def carica_file(contenuto, nome_file):
+    """Legge il file caricato (CSV o Excel) e ne rinomina le colonne. In cache per contenuto."""
+    # Servono solo le prime 10 colonne: le altre non vengono usate
+    if nome_file.endswith('.csv'):
+        # Le colonne vengono rinominate per posizione, quindi l'intestazione non serve: la saltiamo,
+        # così nomi ripetuti con tipi diversi non fanno fallire pyarrow. Il motore pyarrow
+        # accetta usecols solo per nome, quindi selezioniamo per posizione dopo.
+        df = pd.read_csv(
+            BytesIO(contenuto), engine='pyarrow', dtype_backend='pyarrow', header=None, skiprows=1
+        ).iloc[:, :10]
+    else:
+        df = pd.read_excel(BytesIO(contenuto), engine='calamine', usecols=range(10))
+    df.columns = [
+        'Esercizio', 'Data_Reg', 'N_Reg', 'Sede', 'Descrizione', 'Data_Doc',
+        'N_Doc', 'Prot', 'Dare', 'Avere'
+    ]
+    return df
+
+@st.cache_data(show_spinner=False)
+def prepara_dati(df):
+    """
+    Converte gli importi e normalizza i nomi dei clienti: è la parte costosa che non
+    dipende dai parametri, quindi resta in cache quando si cambiano tolleranza e soglia.
+    """
+    df = df.copy()
+    df['Dare_Num'] = pulisci_valuta(df['Dare'])
+    df['Avere_Num'] = pulisci_valuta(df['Avere'])
+    df['Nome_Norm'] = df['Descrizione'].apply(normalizza_nome_cliente)
+    return df
+
 # --- 2. CUORE DELLA LOGICA: LA RICONCILIAZIONE (MODIFICATA) ---
 
-def riconcilia_transazioni(df, tolleranza, soglia_similarita):
+@njit(cache=True)
+def abbina_greedy(offset, coppie_credito, punteggi, differenze, n_crediti):
+    """
+    Scorre i debiti in ordine e assegna a ciascuno il miglior credito ancora libero.
+    Le coppie valide del debito i occupano le posizioni [offset[i], offset[i + 1]).
+    Restituisce le posizioni dei debiti abbinati e delle coppie scelte.
+    """
+    n_debiti = offset.shape[0] - 1
+    credito_usato = np.zeros(n_crediti, dtype=np.bool_)
+    abbinati_debito = np.empty(n_debiti, dtype=np.int64)
+    abbinati_coppia = np.empty(n_debiti, dtype=np.int64)
+    n_abbinati = 0
+
+    for i in range(n_debiti):
+        migliore = -1
+        for k in range(offset[i], offset[i + 1]):
+            if credito_usato[coppie_credito[k]]:
+                continue
+            # Priorità 1: Massima Similarità
+            # Priorità 2: Minima Differenza (a parità di similarità)
+            if (migliore == -1
+                    or punteggi[k] > punteggi[migliore]
+                    or (punteggi[k] == punteggi[migliore] and differenze[k] < differenze[migliore])):
+                migliore = k
+                # Coppia perfetta (nome identico, stesso importo): nessun credito
+                # successivo può batterla, inutile scorrere il resto del blocco
+                if punteggi[k] >= 100.0 and differenze[k] == 0.0:
+                    break
+
+        if migliore != -1:
+            credito_usato[coppie_credito[migliore]] = True
+            abbinati_debito[n_abbinati] = i
+            abbinati_coppia[n_abbinati] = migliore
+            n_abbinati += 1
+
+    return abbinati_debito[:n_abbinati], abbinati_coppia[:n_abbinati]
+
+def abbina_ottimale(offset, coppie_credito, punteggi, differenze, n_crediti, tolleranza):
+    """
+    Abbinamento ottimo globale: risolve il problema di assegnamento sul grafo bipartito
+    (sparso) delle coppie valide, massimizzando la similarità complessiva invece di
+    scegliere debito per debito. Restituisce gli stessi risultati di abbina_greedy.
+    """
+    n_debiti = offset.shape[0] - 1
+    if n_debiti == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    coppie_debito = np.repeat(np.arange(n_debiti), np.diff(offset))
+    # Costo di una coppia valida (tra 1 e 101): più è simile, meno costa; a parità di
+    # similarità preferiamo la differenza di importo minore (peso trascurabile).
+    costi = 101.0 - punteggi + 1e-3 * differenze / max(tolleranza, 1e-9)
+    # Ogni debito ha anche un credito fittizio (costo 102) che significa "non abbinato":
+    # così l'assegnamento completo esiste sempre. Ogni abbinamento in più vale un punto di
+    # similarità: il risolutore può lasciare un debito libero per tenere coppie più simili.
+    righe = np.concatenate([coppie_debito, np.arange(n_debiti)])
+    colonne = np.concatenate([coppie_credito, n_crediti + np.arange(n_debiti)])
+    pesi = np.concatenate([costi, np.full(n_debiti, 102.0)])
+    grafo = csr_matrix((pesi, (righe, colonne)), shape=(n_debiti, n_crediti + n_debiti))
+    debiti_assegnati, crediti_assegnati = min_weight_full_bipartite_matching(grafo)
+
+    # Scartiamo i debiti finiti sul credito fittizio
+    reali = crediti_assegnati < n_crediti
+    abbinati_debito = debiti_assegnati[reali]
+    abbinati_credito = crediti_assegnati[reali]
+    # Le coppie sono ordinate per (debito, credito): ritroviamo la posizione di ciascuna
+    chiavi_coppie = coppie_debito.astype(np.int64) * n_crediti + coppie_credito
+    abbinati_coppia = np.searchsorted(chiavi_coppie, abbinati_debito * n_crediti + abbinati_credito)
+    return abbinati_debito, abbinati_coppia
+
+def riconcilia_transazioni(df, tolleranza, soglia_similarita, metodo='greedy'):
     """
     Funzione principale che abbina le transazioni di Dare e Avere.
     Usa una soglia di similarità (fuzzy matching) per le descrizioni.
+    Con metodo='ottimale' l'abbinamento massimizza la similarità complessiva,
+    con metodo='greedy' i debiti scelgono il miglior credito libero uno alla volta.
+    Il DataFrame deve essere già passato da prepara_dati.
     """
-    # Prepara i dati di lavoro
-    df_lavoro = df.copy()
-    df_lavoro['ID_Originale'] = df_lavoro.index
-    df_lavoro['Importo_Unico'] = df_lavoro['Dare_Num'] + df_lavoro['Avere_Num']
-    
-    # Normalizza la descrizione per il matching
-    df_lavoro['Nome_Norm'] = df_lavoro['Descrizione'].apply(normalizza_nome_cliente)
-    
-    # Separa crediti (Avere) e debiti (Dare)
-    crediti = df_lavoro[df_lavoro['Avere_Num'] > 0].sort_values('Avere_Num').to_dict('records')
-    debiti = df_lavoro[df_lavoro['Dare_Num'] > 0].sort_values('Dare_Num').to_dict('records')
-
-    riconciliati = []
-    id_usati_debito = set()
-    id_usati_credito = set()
-
-    for debito in debiti:
-        if debito['ID_Originale'] in id_usati_debito:
-            continue
-        
-        miglior_match = None
-        miglior_similarita = -1.0  # Partiamo da un valore impossibile
-        miglior_diff = float('inf')
-        
-        nome_debito = debito['Nome_Norm']
-
-        for credito in crediti:
-            if credito['ID_Originale'] in id_usati_credito:
-                continue
+    # Lavoriamo sulle colonne come array (non su un dizionario per riga) e senza copiare
+    # il DataFrame: debiti (Dare) e crediti (Avere) sono individuati dalla loro posizione
+    # (riga) in df, ordinati per importo.
+    dare = df['Dare_Num'].to_numpy(dtype=np.float64)
+    avere = df['Avere_Num'].to_numpy(dtype=np.float64)
+    nomi = df['Nome_Norm'].to_numpy(dtype=object)
+    pos_debiti = np.flatnonzero(dare > 0)
+    pos_debiti = pos_debiti[np.argsort(dare[pos_debiti])]
+    pos_crediti = np.flatnonzero(avere > 0)
+    pos_crediti = pos_crediti[np.argsort(avere[pos_crediti])]
 
-            diff = abs(debito['Dare_Num'] - credito['Avere_Num'])
-
-            # --- LOGICA DI MATCHING MODIFICATA ---
-            # 1. Controlla se l'importo è entro la tolleranza
-            if diff <= tolleranza:
-                
-                nome_credito = credito['Nome_Norm']
-                
-                # 2. Calcola la similarità (0.0 a 1.0)
-                #    Ignoriamo il match se uno dei due è "N/D"
-                if nome_debito == "N/D" or nome_credito == "N/D":
-                    similarita = 0.0
-                else:
-                    similarita = SequenceMatcher(None, nome_debito, nome_credito).ratio()
-
-                # 3. Controlla se la similarità è sopra la soglia
-                if similarita >= soglia_similarita:
-                    
-                    # 4. Trovato un candidato. È il migliore finora?
-                    #    Priorità 1: Massima Similarità
-                    #    Priorità 2: Minima Differenza (a parità di similarità)
-                    
-                    if similarita > miglior_similarita:
-                        # Trovato un match *più simile*
-                        miglior_similarita = similarita
-                        miglior_diff = diff
-                        miglior_match = credito
-                    elif similarita == miglior_similarita:
-                        # Trovato un match *altrettanto simile*
-                        # Scegliamo quello con la differenza di importo minore
-                        if diff < miglior_diff:
-                            miglior_diff = diff
-                            miglior_match = credito
-            
-        # --- FINE LOGICA DI MATCHING ---
-
-        if miglior_match:
-            riconciliati.append({
-                'Data_Dare': debito['Data_Reg'],
-                'Descrizione_Dare': debito['Descrizione'],
-                'Importo_Dare': debito['Dare_Num'],
-                'Data_Avere': miglior_match['Data_Reg'],
-                'Descrizione_Avere': miglior_match['Descrizione'],
-                'Importo_Avere': miglior_match['Avere_Num'],
-                'Differenza': miglior_diff,
-                'Similarita_Desc': miglior_similarita # <-- Nuova colonna
-            })
-            id_usati_debito.add(debito['ID_Originale'])
-            id_usati_credito.add(miglior_match['ID_Originale'])
-
-    id_riconciliati = id_usati_debito.union(id_usati_credito)
-    
-    # Gestione DataFrame vuoto
-    if not riconciliati:
-        df_riconciliati = pd.DataFrame(columns=[
-            'Data_Dare', 'Descrizione_Dare', 'Importo_Dare', 
-            'Data_Avere', 'Descrizione_Avere', 'Importo_Avere', 
-            'Differenza', 'Similarita_Desc'
-        ])
+    # Le similarità di rapidfuzz sono su scala 0-100: convertiamo la soglia una volta sola
+    soglia_punteggio = np.float32(soglia_similarita * 100)
+
+    nomi_debiti = nomi[pos_debiti]
+    nomi_crediti = nomi[pos_crediti]
+    importi_dare = dare[pos_debiti]
+    importi_avere = avere[pos_crediti]
+
+    # --- BLOCCO SUGLI IMPORTI ---
+    # Essendo i crediti ordinati per importo, per ogni debito i crediti entro la tolleranza
+    # stanno in una finestra contigua [inizio, fine): la troviamo per tutti i debiti insieme.
+    # Gli importi restano float64: in float32 i centesimi di importi a 5 cifre non sono
+    # esatti e il confronto con la tolleranza cambierebbe esito. Le posizioni invece
+    # stanno comodamente in int32, che dimezza la memoria degli array delle coppie.
+    inizio = np.searchsorted(importi_avere, importi_dare - tolleranza, side='left').astype(np.int32)
+    fine = np.searchsorted(importi_avere, importi_dare + tolleranza, side='right').astype(np.int32)
+    n_candidati = fine - inizio
+    # Le coppie candidate (debito, credito) sono appiattite: quelle del debito i
+    # occupano le posizioni [offset[i], offset[i + 1])
+    offset = np.zeros(len(pos_debiti) + 1, dtype=np.int32)
+    np.cumsum(n_candidati, out=offset[1:])
+    coppie_debito = np.repeat(np.arange(len(pos_debiti), dtype=np.int32), n_candidati)
+    coppie_credito = np.arange(offset[-1], dtype=np.int32) - np.repeat(offset[:-1] - inizio, n_candidati)
+
+    # Differenza di importo calcolata in un colpo solo su tutte le coppie
+    differenze = np.abs(importi_dare[coppie_debito] - importi_avere[coppie_credito])
+
+    # --- INDICE DEI NOMI ---
+    # Nei registri gli stessi clienti ricorrono molte volte: indicizziamo i nomi distinti
+    # e calcoliamo la similarità (0 a 100) una sola volta per ogni coppia di nomi distinti.
+    codici_debiti, nomi_unici_debiti = pd.factorize(nomi_debiti)
+    codici_crediti, nomi_unici_crediti = pd.factorize(nomi_crediti)
+    n_nomi_crediti = len(nomi_unici_crediti)
+    chiavi = codici_debiti[coppie_debito] * n_nomi_crediti + codici_crediti[coppie_credito]
+    coppia_nomi, chiavi_uniche = pd.factorize(chiavi)
+    nomi_d = nomi_unici_debiti[chiavi_uniche // max(n_nomi_crediti, 1)]
+    nomi_c = nomi_unici_crediti[chiavi_uniche % max(n_nomi_crediti, 1)]
+    punteggi_nomi = process.cpdist(
+        nomi_d, nomi_c,
+        scorer=fuzz.ratio,
+        score_cutoff=soglia_punteggio,
+        dtype=np.float32,
+        workers=-1
+    )
+    # Ignoriamo il match se uno dei due è "N/D"
+    punteggi_nomi[(nomi_d == "N/D") | (nomi_c == "N/D")] = 0.0
+    punteggi = punteggi_nomi[coppia_nomi]
+    # Una coppia è valida se l'importo è entro la tolleranza e la similarità sopra la soglia
+    coppie_valide = (differenze <= tolleranza) & (punteggi >= soglia_punteggio)
+
+    # Teniamo solo le coppie valide: l'abbinamento non deve più scartare nulla
+    valide = np.flatnonzero(coppie_valide)
+    coppie_debito = coppie_debito[valide]
+    coppie_credito = coppie_credito[valide]
+    differenze = differenze[valide]
+    punteggi = punteggi[valide]
+    offset = np.searchsorted(coppie_debito, np.arange(len(pos_debiti) + 1), side='left').astype(np.int32)
+
+    # Posizioni dei debiti abbinati e delle rispettive coppie
+    if metodo == 'ottimale':
+        abbinati_debito, abbinati_coppia = abbina_ottimale(
+            offset, coppie_credito, punteggi, differenze, len(pos_crediti), tolleranza
+        )
     else:
-        df_riconciliati = pd.DataFrame(riconciliati)
+        abbinati_debito, abbinati_coppia = abbina_greedy(
+            offset, coppie_credito, punteggi, differenze, len(pos_crediti)
+        )
+    # Righe di df abbinate
+    righe_abbinate_debito = pos_debiti[abbinati_debito]
+    righe_abbinate_credito = pos_crediti[coppie_credito[abbinati_coppia]]
 
-    df_residui = df[~df.index.isin(id_riconciliati)].copy()
+    # Costruisce il report per colonne, prendendo le righe abbinate per posizione
+    righe_debito = df.iloc[righe_abbinate_debito]
+    righe_credito = df.iloc[righe_abbinate_credito]
+    df_riconciliati = pd.DataFrame({
+        'Data_Dare': righe_debito['Data_Reg'].to_numpy(),
+        'Descrizione_Dare': righe_debito['Descrizione'].to_numpy(),
+        'Importo_Dare': righe_debito['Dare_Num'].to_numpy(),
+        'Data_Avere': righe_credito['Data_Reg'].to_numpy(),
+        'Descrizione_Avere': righe_credito['Descrizione'].to_numpy(),
+        'Importo_Avere': righe_credito['Avere_Num'].to_numpy(),
+        'Differenza': differenze[abbinati_coppia],
+        'Similarita_Desc': punteggi[abbinati_coppia] / 100 # <-- Nuova colonna (0.0 a 1.0)
+    })
+
+    # I residui sono le righe non abbinate: maschera booleana per posizione, senza copia
+    riconciliata = np.zeros(len(df), dtype=bool)
+    riconciliata[righe_abbinate_debito] = True
+    riconciliata[righe_abbinate_credito] = True
+    df_residui = df.loc[~riconciliata]
 
     return df_riconciliati, df_residui
 
@@ -158,24 +302,15 @@ st.markdown("Questa app abbina le transazioni in 'Dare' e 'Avere' basandosi su i
 uploaded_file = st.file_uploader("Carica il tuo file Excel (.xlsx) o CSV (.csv)", type=["xlsx", "csv"])
 
 if uploaded_file:
-    # Lettura flessibile del file
+    # Lettura flessibile del file (in cache: non viene riletto a ogni modifica dei parametri)
     try:
-        if uploaded_file.name.endswith('.csv'):
-            df = pd.read_csv(uploaded_file)
-        else:
-            df = pd.read_excel(uploaded_file, engine='openpyxl')
+        df = carica_file(uploaded_file.getvalue(), uploaded_file.name)
     except Exception as e:
         st.error(f"Errore nella lettura del file: {e}")
         st.stop()
 
-    # --- SETUP E PRE-PROCESSING ---
-    df.columns = [
-        'Esercizio', 'Data_Reg', 'N_Reg', 'Sede', 'Descrizione', 'Data_Doc',
-        'N_Doc', 'Prot', 'Dare', 'Avere', 'Col11', 'Col12', 'Col13', 'Col14',
-        'Col15', 'Col16', 'Col17', 'Col18', 'Col19', 'Col20', 'Col21'
-    ]
-    df['Dare_Num'] = df['Dare'].apply(pulisci_valuta)
-    df['Avere_Num'] = df['Avere'].apply(pulisci_valuta)
+    # --- SETUP E PRE-PROCESSING (in cache) ---
+    df = prepara_dati(df)
     
     # --- PANNELLO DI CONTROLLO (Modificato) ---
     st.sidebar.header("Impostazioni di Riconciliazione")
@@ -200,10 +335,17 @@ if uploaded_file:
     )
     # -----------------------------------
 
+    metodo = st.sidebar.radio(
+        "Metodo di abbinamento",
+        options=['ottimale', 'greedy'],
+        format_func=lambda m: "Ottimale (assegnamento globale)" if m == 'ottimale' else "Greedy (un debito alla volta)",
+        help="Ottimale massimizza la similarità complessiva di tutte le coppie; Greedy abbina i debiti in ordine di importo al miglior credito ancora libero."
+    )
+
     # --- ESECUZIONE E VISUALIZZAZIONE ---
     if st.sidebar.button("Avvia Riconciliazione", type="primary"):
         with st.spinner("Sto cercando gli abbinamenti..."):
-            df_riconciliati, df_residui = riconcilia_transazioni(df, tolleranza, soglia_similarita)
+            df_riconciliati, df_residui = riconcilia_transazioni(df, tolleranza, soglia_similarita, metodo)
 
         st.success(f"Analisi completata! Trovate **{len(df_riconciliati)}** coppie riconciliate.")
 
@@ -228,12 +370,19 @@ if uploaded_file:
         # --- 2. TABELLA DELLE TRANSAZIONI RESIDUE ---
         st.header("⚠️ Transazioni Residue non Abbinate")
         if not df_residui.empty:
-            st.dataframe(df_residui[['Data_Reg', 'Descrizione', 'Dare_Num', 'Avere_Num']])
+            report_residui = df_residui[['Data_Reg', 'Descrizione', 'Dare_Num', 'Avere_Num']]
+            st.dataframe(report_residui)
             st.download_button(
                 "📥 Scarica Report Residui",
-                to_excel(df_residui[['Data_Reg', 'Descrizione', 'Dare_Num', 'Avere_Num']]),
+                to_excel(report_residui),
                 "report_residui.xlsx"
             )
+            st.download_button(
+                "📥 Scarica Report Residui (CSV)",
+                to_csv(report_residui),
+                "report_residui.csv",
+                mime="text/csv"
+            )
         else:
             st.balloons()
             st.success("Fantastico! Tutte le transazioni sono state riconciliate!")